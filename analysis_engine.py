@@ -0,0 +1,386 @@
+# Analysis Engine (DataKnight)
+
+import os
+import io
+import glob
+import time
+import pickle
+import asyncio
+import chess.pgn
+import pandas as pd
+from collections import Counter
+from functools import lru_cache
+from chessdotcom import ChessDotComClientError
+from chessdotcom.aio import get_player_games_by_month
+from instrumentation import span, count_retry
+
+"""
+This is the headless part of the position analysis: fetching a player's games, parsing them into a DataFrame, replaying every game into
+its positions (FENs), aggregating opening stats and building the position index. It has no Streamlit dependency so the same code is used
+by player-analysis.py for interactive sessions and by batch-analysis.py to precompute reports for many players. save_report() pickles
+a report's partitions only and load_report() rebuilds the combined views from them; the web app uses the partitions instead of
+fetching/parsing for any of the months it covers.
+
+Reports are made of per-month partitions (parsed games, opening counts and position index entries). update_report() adds the partitions
+for months that are new to the range and removes the ones that fell out, updating the combined opening counts and position index in
+place, so changing the date range only costs the months that weren't loaded yet. Each partition records when its games were fetched;
+a month that hadn't ended by then (e.g. the current month) is incomplete and is fetched again the next time the report is updated.
+"""
+
+ECO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'eco_codes.csv')
+REPORTS_DIR = os.environ.get('DATAKNIGHT_REPORTS', './reports')
+COLORS = {True: 'white', False: 'black'}
+
+
+def track(iterable, progress=None, **kwargs):
+    """
+    Wraps the iterable in the given progress bar (e.g. tqdm/stqdm) if there is one.
+    """
+    return progress(iterable, **kwargs) if progress else iterable
+
+
+def month_range(start_month, start_year, end_month, end_year):
+    """
+    This function returns a list of (yyyy, mm) strings for every month in the given timeframe (empty if the range is invalid).
+    """
+    periods = pd.period_range(start=f'{start_year}-{int(start_month):02d}', end=f'{end_year}-{int(end_month):02d}', freq='M')
+    return [(str(month)[:4], str(month)[-2:]) for month in periods]
+
+
+async def fetch_month(username, year, month, semaphore=None, retries=0, retry_wait=1.0):
+    """
+    This function returns a list of all games that the player has completed in the given month. Rate-limited (429) requests are
+    retried with exponential backoff without blocking other requests (the client's own rate limit handler sleeps synchronously).
+    """
+    for attempt in range(retries + 1):
+        try:
+            if semaphore is None:
+                data = await get_player_games_by_month(username=username, year=year, month=month)
+            else:
+                async with semaphore:
+                    data = await get_player_games_by_month(username=username, year=year, month=month)
+            return list(data.json.values())[0]
+        except ChessDotComClientError as err:
+            if err.status_code != 429 or attempt == retries:
+                raise
+            count_retry(err.url, err.status_code)
+            await asyncio.sleep(retry_wait * 2**attempt)
+
+
+async def fetch_games(username, months, progress=None, semaphore=None, concurrency=None, retries=0, retry_wait=1.0):
+    """
+    This function returns a dict of (yyyy, mm) -> list of all games that the player has completed in that month, for the given months.
+    Months are requested concurrently, limited by the given semaphore or by `concurrency` open requests.
+    """
+    if semaphore is None and concurrency:
+        semaphore = asyncio.Semaphore(concurrency)
+
+    with span('fetch', target='games', username=username, months=len(months)):
+        tasks = [asyncio.ensure_future(fetch_month(username, year, month, semaphore, retries, retry_wait)) for year, month in months]
+        try:
+            for task in track(asyncio.as_completed(tasks), progress, total=len(tasks), desc=':runner: Getting games'):
+                await task
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    return {month: task.result() for month, task in zip(months, tasks)}
+
+
+@lru_cache(maxsize=1)
+def load_openings():
+    """
+    Returns the ECO table as a dict of eco code -> (opening name, opening pgn). Read once per process.
+    """
+    openings = pd.read_csv(ECO_PATH).drop_duplicates(subset='eco')
+    return {eco: (name, pgn) for eco, name, pgn in zip(openings['eco'], openings['name'], openings['pgn'])}
+
+
+def parse_games(games, progress=None):
+    """
+    This functions converts a list of games into a pandas DataFrame.
+    """
+    games_df = []
+    openings = load_openings()
+
+    # extract attributes for each game
+    for game in track(games, progress, desc=':male-factory-worker: Parsing games'):
+      game_id = game['url'].split('/')[-1]
+      white_player = game['white']['username']
+      black_player = game['black']['username']
+      white_rating = game['white']['rating']
+      black_rating = game['black']['rating']
+      white_result = game['white']['result']
+      black_result = game['black']['result']
+      time_class = game['time_class']
+      time_control = game['time_control']
+      rated = game['rated']
+      rules = game['rules']
+
+      # include opening/pgn if a move has been played
+      try:
+        pgn = game['pgn']
+        eco = game['pgn'].split('ECO "')[1].split('"')[0]
+        opening, opening_pgn = openings[eco]
+
+      except (KeyError, IndexError):
+        eco = None
+        pgn = None
+        opening = None
+        opening_pgn = None
+
+      # create row in df
+      games_df.append({'game_id':game_id, 'eco':eco, 'opening':opening, 'white_player':white_player, 'black_player':black_player,
+                       'white_rating':white_rating, 'black_rating':black_rating, 'white_result':white_result, 'black_result':black_result,
+                       'time_class':time_class, 'time_control':time_control, 'rated':rated, 'rules':rules, 'opening_pgn':opening_pgn,'pgn':pgn})
+
+    return pd.DataFrame.from_records(games_df, columns=['game_id', 'eco', 'opening', 'white_player', 'black_player', 'white_rating',
+                                                        'black_rating', 'white_result', 'black_result', 'time_class', 'time_control',
+                                                        'rated', 'rules', 'opening_pgn', 'pgn'])
+
+
+def get_fens(pgns, progress=None):
+    """
+    This function replays each game and returns the list of positions (board part of the FEN) reached after every move.
+    """
+    all_fens = []
+    for pgn in track(pgns, progress, desc=':repeat: Replaying games'):
+        game = chess.pgn.read_game(io.StringIO(pgn))
+        board = game.board()
+        fens = [board.fen().split(" ")[0]]
+
+        for move in game.mainline_moves():
+            board.push(move)
+            fens.append(board.fen().split(" ")[0])
+
+        all_fens.append(fens)
+
+    return all_fens
+
+
+def prepare_games(games, progress=None):
+    """
+    This function parses the raw games, keeps standard chess games with moves and adds the positions reached in each game.
+    """
+    with span('parse', games=len(games)):
+        games_df = parse_games(games, progress)
+        games_df = games_df[(games_df['rules']=='chess')]
+        games_df = games_df.dropna(subset='pgn')
+        games_df = games_df.reset_index(drop=True)
+        games_df['white_player'] = games_df['white_player'].str.lower()
+        games_df['black_player'] = games_df['black_player'].str.lower()
+
+    with span('replay', games=len(games_df)):
+        games_df['fens'] = get_fens(games_df['pgn'], progress)
+
+    return games_df
+
+
+def opening_counts(games_df, username, white):
+    """
+    This function returns a Counter of the openings faced by the player as the given color.
+    """
+    analysis_df = games_df[games_df[f'{COLORS[white]}_player']==username]
+    return Counter(analysis_df['opening'].value_counts().to_dict())
+
+
+def opening_stats(counts):
+    """
+    This function returns the opening stats table (most played first, ties by name) for the given opening counts.
+    """
+    openings_stats = pd.DataFrame()
+
+    # sort ties by name, Counter.most_common() keeps them in insertion order which depends on the order the months were added
+    counts = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    total = sum(value for _, value in counts)
+    openings_stats['Opening'] = [opening for opening, _ in counts]
+    openings_stats['Games Played'] = [f'{value} ({100.0*value/total:0.1f}%)' for _, value in counts]
+
+    return openings_stats
+
+
+def build_position_index(games_df, username):
+    """
+    This function maps every position reached in the player's games to the (game_id, result) of those games, for each color.
+    A game is counted once per position even if the position repeats.
+    """
+    index = {'white': {}, 'black': {}}
+    with span('index', games=len(games_df)):
+        for white, color in COLORS.items():
+            color_df = games_df[games_df[f'{color}_player']==username]
+            for game_id, result, fens in zip(color_df['game_id'], color_df[f'{color}_result'], color_df['fens']):
+                for fen in set(fens):
+                    index[color].setdefault(fen, []).append((game_id, result))
+    return index
+
+
+def position_results(index, fen, white, exclude_game_id=None):
+    """
+    This function returns the player's results in previous games that reached the given position as the given color.
+    """
+    return [result for game_id, result in index[COLORS[white]].get(fen, []) if game_id != exclude_game_id]
+
+
+def build_partition(username, games, fetched_at, progress=None):
+    """
+    This function runs the analysis for one month of the player's games and returns the partition (prepared games, opening counts and
+    position index entries). `fetched_at` is the time (epoch seconds) the games were requested.
+    """
+    games_df = prepare_games(games, progress)
+    with span('aggregate'):
+        openings = {color: opening_counts(games_df, username, white) for white, color in COLORS.items()}
+    return {'num_games': len(games), 'fetched_at': fetched_at, 'games_df': games_df, 'openings': openings,
+            'positions': build_position_index(games_df, username)}
+
+
+def month_end(month):
+    """
+    Returns the end of the given (yyyy, mm) month in epoch seconds (UTC, like chess.com's monthly archives).
+    """
+    return pd.Period(f'{month[0]}-{month[1]}', freq='M').end_time.tz_localize('UTC').timestamp()
+
+
+def is_complete(partition, month):
+    """
+    A partition is complete if its games were fetched after the month ended, so no more games can be added to it.
+    """
+    return partition.get('fetched_at', 0) > month_end(month)
+
+
+def empty_games():
+    return parse_games([]).assign(fens=[])
+
+
+def new_report(username):
+    return {'username': username, 'months': [], 'partitions': {}, 'num_games': 0, 'games_df': empty_games(),
+            'opening_counts': {'white': Counter(), 'black': Counter()}, 'openings': {}, 'positions': {'white': {}, 'black': {}}}
+
+
+def add_partition(report, month, partition):
+    """
+    Adds a month to the report, merging its opening counts and position index entries into the combined ones.
+    """
+    report['partitions'][month] = partition
+    for color in COLORS.values():
+        report['opening_counts'][color].update(partition['openings'][color])
+        index = report['positions'][color]
+        for fen, entries in partition['positions'][color].items():
+            index.setdefault(fen, []).extend(entries)
+
+
+def remove_partition(report, month):
+    """
+    Removes a month from the report, taking its opening counts and position index entries out of the combined ones.
+    """
+    partition = report['partitions'].pop(month)
+    game_ids = set(partition['games_df']['game_id'])
+    for color in COLORS.values():
+        report['opening_counts'][color].subtract(partition['openings'][color])
+        report['opening_counts'][color] = +report['opening_counts'][color]
+        index = report['positions'][color]
+        for fen in partition['positions'][color]:
+            entries = [entry for entry in index.get(fen, []) if entry[0] not in game_ids]
+            if entries:
+                index[fen] = entries
+            else:
+                index.pop(fen, None)
+
+
+def update_report(report, months, games=None, progress=None, fetched_at=None, partitions=None):
+    """
+    This function brings the report up to date with the given months: months that fell out of the range are removed, the given
+    games (a dict of month -> games, see fetch_games(), requested at `fetched_at`) are analyzed and added as new partitions, and the
+    given ready-made partitions (e.g. from saved_partitions()) are added as they are. New partitions replace the report's partition
+    for the same month. Returns the report.
+    """
+    fetched_at = fetched_at or time.time()
+    new_partitions = dict(partitions or {})
+    for month, month_games in (games or {}).items():
+        if month in months:
+            new_partitions[month] = build_partition(report['username'], month_games, fetched_at, progress)
+
+    for month in [month for month in report['partitions'] if month not in months or month in new_partitions]:
+        remove_partition(report, month)
+    for month, partition in new_partitions.items():
+        if month in months:
+            add_partition(report, month, partition)
+
+    # rebuild the combined views (in month order)
+    with span('aggregate', months=len(months)):
+        report['months'] = sorted(report['partitions'])
+        partitions = [report['partitions'][month] for month in report['months']]
+        report['num_games'] = sum(partition['num_games'] for partition in partitions)
+        report['games_df'] = pd.concat([partition['games_df'] for partition in partitions], ignore_index=True) if partitions else empty_games()
+        report['openings'] = {color: opening_stats(counts) for color, counts in report['opening_counts'].items()}
+
+    return report
+
+
+def missing_months(report, months):
+    """
+    This function returns the months of the range that aren't in the report yet or were incomplete when fetched (the only ones that
+    need to be fetched).
+    """
+    return [month for month in months if month not in report['partitions'] or not is_complete(report['partitions'][month], month)]
+
+
+def build_report(username, months, games, progress=None, fetched_at=None):
+    """
+    This function runs the analysis for one player and returns the report (prepared games, opening stats and position index).
+    """
+    return update_report(new_report(username), months, games, progress, fetched_at)
+
+
+def saved_partitions(username, months, reports_dir=None):
+    """
+    This function returns the complete partitions for any of the given months found in the player's saved reports (whatever their
+    date range), as a dict of month -> partition. Reports that don't cover any of the months aren't loaded.
+    """
+    found = {}
+    pattern = os.path.join(reports_dir or REPORTS_DIR, f'{glob.escape(username.lower())}_????-??_????-??.pkl')
+    for path in sorted(glob.glob(pattern)):
+        start, end = os.path.basename(path)[:-len('.pkl')].split('_')[-2:]
+        wanted = [month for month in months if start <= '-'.join(month) <= end and month not in found]
+        if not wanted:
+            continue
+        partitions = read_report(path)['partitions']
+        for month in wanted:
+            if month in partitions and is_complete(partitions[month], month):
+                found[month] = partitions[month]
+    return found
+
+
+def report_path(username, months, reports_dir=None):
+    """
+    This function returns the report file for the player and date range, or None if the range is empty.
+    """
+    if not months:
+        return None
+    (start_year, start_month), (end_year, end_month) = months[0], months[-1]
+    return os.path.join(reports_dir or REPORTS_DIR, f'{username.lower()}_{start_year}-{start_month}_{end_year}-{end_month}.pkl')
+
+
+def save_report(report, path):
+    """
+    Writes the report's partitions (the combined views are rebuilt from them by load_report()).
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({key: report[key] for key in ('username', 'months', 'partitions')}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_report(path):
+    """
+    Returns the saved report as written by save_report() (username, months and partitions, without the combined views).
+    """
+    with span('load', path=path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def load_report(path):
+    saved = read_report(path)
+    return update_report(new_report(saved['username']), saved['months'], partitions=saved['partitions'])
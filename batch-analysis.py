@@ -0,0 +1,130 @@
+# Batch Position Analysis (DataKnight)
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from chessdotcom import Client, RateLimitHandler
+from analysis_engine import month_range, fetch_games, new_report, update_report, missing_months, report_path, save_report, read_report, load_report
+from instrumentation import metrics, configure_client, write_prometheus
+
+"""
+This is a script to precompute opening and position reports for many players at once (e.g. nightly for all members of a club), using the
+same engine as player-analysis.py. Games are fetched asynchronously for all players (limited by --concurrency open requests) and each
+player's games are parsed, replayed and aggregated in a process pool. One report file is written per player; the web app loads it
+instantly when a user asks for any of those months. Rerunning the batch (e.g. nightly) only fetches the months that are missing or were
+incomplete in the existing reports and updates them in place.
+
+Example:
+    python batch-analysis.py tensirr hikaru --start 2023-08 --end 2023-09
+    python batch-analysis.py --users-file club_members.txt --start 2023-01 --end 2023-09 --workers 8
+"""
+
+configure_client()
+
+
+def analyze_player(username, months, games, fetched_at, reports_dir, overwrite=False):
+    """
+    Adds the fetched months to the player's existing report (or a new one) and writes it (runs in a worker process). The worker's
+    stage timings are returned with the result so they can be merged into the parent's metrics.
+    """
+    # workers are reused between players, only send back this player's observations
+    metrics.reset()
+    path = report_path(username, months, reports_dir)
+    report = load_report(path) if not overwrite and os.path.exists(path) else new_report(username)
+    update_report(report, months, games, fetched_at=fetched_at)
+    save_report(report, path)
+    return path, len(report['games_df']), metrics.snapshot()
+
+
+def months_to_fetch(username, months, reports_dir, overwrite=False):
+    """
+    This function returns the months that have to be fetched for the player: all of them for a new report (or with --overwrite),
+    otherwise the ones missing or incomplete in the existing report.
+    """
+    path = report_path(username, months, reports_dir)
+    if overwrite or not os.path.exists(path):
+        return months
+    return missing_months(read_report(path), months)
+
+
+async def run_batch(usernames, months, reports_dir, workers, concurrency, retries=3, retry_wait=1.0, overwrite=False):
+    """
+    This function fetches every player's games concurrently and hands each player to the process pool as soon as their games arrive.
+    Returns a dict of username -> (report path, games analyzed) for the players that succeeded and a dict of username -> error otherwise.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    done, failed = {}, {}
+
+    # only fetch what the existing reports don't have yet (e.g. the current month), players with a complete report are skipped
+    missing = {username: months_to_fetch(username, months, reports_dir, overwrite) for username in usernames}
+    usernames = [username for username in usernames if missing[username]]
+
+    async def process(username, pool):
+        try:
+            fetched_at = time.time()
+            games = await fetch_games(username, missing[username], semaphore=semaphore, retries=retries, retry_wait=retry_wait)
+            path, num_games, snapshot = await loop.run_in_executor(pool, analyze_player, username, months, games, fetched_at, reports_dir,
+                                                                   overwrite)
+            metrics.merge(snapshot)
+            done[username] = (path, num_games)
+        except Exception as err:
+            failed[username] = err
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = [asyncio.ensure_future(process(username, pool)) for username in usernames]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc='Analyzing players'):
+            await task
+
+    return done, failed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Precompute opening and position reports for a list of chess.com players.')
+    parser.add_argument('usernames', nargs='*', help='chess.com usernames')
+    parser.add_argument('--users-file', help='file with one username per line')
+    parser.add_argument('--start', required=True, help='first month (yyyy-mm)')
+    parser.add_argument('--end', required=True, help='last month (yyyy-mm)')
+    parser.add_argument('--reports-dir', default=None, help='output directory (default DATAKNIGHT_REPORTS or ./reports)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes used to replay/aggregate games')
+    parser.add_argument('--concurrency', type=int, default=4, help='maximum simultaneous requests to chess.com')
+    parser.add_argument('--retries', type=int, default=3, help='retries after a 429 response')
+    parser.add_argument('--retry-wait', type=float, default=1.0, help='seconds to wait before retrying after a 429 response')
+    parser.add_argument('--overwrite', action='store_true', help='rebuild reports that already exist')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    usernames = list(args.usernames)
+    if args.users_file:
+        with open(args.users_file) as f:
+            usernames.extend(line.strip() for line in f if line.strip())
+    # remove duplicate players (keeping order)
+    usernames = list(dict.fromkeys(username.lower() for username in usernames))
+
+    start_year, start_month = args.start.split('-')
+    end_year, end_month = args.end.split('-')
+    months = month_range(start_month, start_year, end_month, end_year)
+    if not usernames or not months:
+        sys.exit('Nothing to do: give at least one username and a valid date range.')
+
+    # 429s are retried by the engine with non-blocking backoff instead of the client's sleeping handler
+    Client.rate_limit_handler = RateLimitHandler(tts=0, retries=0)
+    done, failed = asyncio.run(run_batch(usernames, months, args.reports_dir, args.workers, args.concurrency, args.retries,
+                                         args.retry_wait, args.overwrite))
+
+    print(f'Wrote {len(done)} reports, {len(failed)} failed, {len(usernames) - len(done) - len(failed)} already complete')
+    for username, err in failed.items():
+        print(f'  {username}: {err}')
+
+    write_prometheus()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ import asyncio
 from tqdm import tqdm
 from random import sample
 from chessdotcom.aio import ChessDotComError, get_country_players, get_country_clubs, get_club_members, get_player_games_by_month
+from instrumentation import configure_client, span, write_prometheus
 
 """
 This is a script to scrape online chess games from chess.com's public API (chess.com/news/view/published-data-api#pubapi-endpoint-country-players). 
@@ -14,6 +15,8 @@ all endpoints provided by the API. Asynchronous requests are made to gather rele
 stats related to each user, and their monthly games played. The file "raw_data.csv" is created in main() to export the retrieved data.
 """
 
+configure_client()
+
 async def get_players(country):
     """
     This function returns a list of users that identify themselves as being in the given country. The chess.com API does not currently 
@@ -106,13 +109,14 @@ async def main():
     countries = pd.read_csv(iso_path)['alpha-2']
 
     # get players from each country
-    for country in tqdm(countries, desc='Getting players'):
-      try :
-        all_players.extend(await get_players(country))
-        # uncomment below to include more players **significantly increases runtime**
-        #all_players.extend(await get_club_players(country))
-      except ChessDotComError:
-        pass
+    with span('fetch', target='players', countries=len(countries)):
+      for country in tqdm(countries, desc='Getting players'):
+        try :
+          all_players.extend(await get_players(country))
+          # uncomment below to include more players **significantly increases runtime**
+          #all_players.extend(await get_club_players(country))
+        except ChessDotComError:
+          pass
 
     # remove duplicate players
     all_players = list(set(all_players))
@@ -122,17 +126,22 @@ async def main():
     random_players = sample(all_players, player_limit) if player_limit < len(all_players) else all_players
 
     # get monthly games for each player
-    all_games = await get_games(random_players, month = '08', year = '2023')
+    with span('fetch', target='games', players=len(random_players)):
+      all_games = await get_games(random_players, month = '08', year = '2023')
 
     # randomize games and limit sample if needed
     game_limit = 10000
     random_games = sample(all_games, game_limit) if game_limit < len(all_games) else all_games
 
     # convert games into df
-    games_df = parse_games(random_games)
+    with span('parse', games=len(random_games)):
+      games_df = parse_games(random_games)
 
     # output csv
-    games_df.to_csv('raw_data.csv')
+    with span('write', rows=len(games_df)):
+      games_df.to_csv('raw_data.csv')
+
+    write_prometheus()
 
 # Run Scraper
 await main()
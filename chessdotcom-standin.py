@@ -0,0 +1,304 @@
+# Chess.com Stand-in Server (DataKnight)
+
+import os
+import re
+import json
+import time
+import random
+import signal
+import hashlib
+import argparse
+import threading
+import urllib.error
+import urllib.request
+import chess
+import chess.pgn
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+This is a local HTTP stand-in for the chess.com public API (chess.com/news/view/published-data-api). It serves the endpoints used by
+chessdotcom-scraper.py and player-analysis.py so that the fetch layer can be load-tested offline without risking a ban. Responses are
+either replayed from files recorded against the real API or generated on the fly, with configurable latency, 429 injection and error
+rates. Point either script at the server by setting the CHESSDOTCOM_HOST environment variable (e.g. CHESSDOTCOM_HOST=http://localhost:8000).
+
+Modes:
+    record   : proxies requests to api.chess.com and saves every successful response under --recordings
+    replay   : serves responses from --recordings, 404 if a request was never recorded
+    generate : serves synthetic (but deterministic per URL) players, clubs, profiles, stats and games
+"""
+
+API_HOST = 'https://api.chess.com'
+
+ENDPOINTS = {
+    'country_players': re.compile(r'^/pub/country/(?P<iso>[A-Za-z]{2})/players$'),
+    'country_clubs': re.compile(r'^/pub/country/(?P<iso>[A-Za-z]{2})/clubs$'),
+    'club_members': re.compile(r'^/pub/club/(?P<club>[^/]+)/members$'),
+    'player_stats': re.compile(r'^/pub/player/(?P<username>[^/]+)/stats$'),
+    'player_games': re.compile(r'^/pub/player/(?P<username>[^/]+)/games/(?P<year>\d{4})/(?P<month>\d{2})$'),
+    'player_profile': re.compile(r'^/pub/player/(?P<username>[^/]+)$'),
+}
+
+# common opening lines so generated games share positions (eco, moves)
+OPENING_LINES = [('C50', 'e4 e5 Nf3 Nc6 Bc4 Bc5'), ('C20', 'e4 e5'), ('B20', 'e4 c5'), ('C00', 'e4 e6'), ('B01', 'e4 d5'),
+                 ('D02', 'd4 d5 Nf3'), ('D00', 'd4 d5'), ('A45', 'd4 Nf6'), ('A40', 'd4'), ('B00', 'e4')]
+TIME_CLASSES = {'bullet':'60', 'blitz':'300', 'rapid':'600', 'daily':'1/86400'}
+LOSSES = ['checkmated', 'resigned', 'timeout', 'abandoned']
+DRAWS = ['agreed', 'repetition', 'stalemate', 'insufficient', 'timevsinsufficient', '50move']
+
+
+def match_endpoint(path):
+    """
+    This function returns the name of the endpoint that serves the given path along with its parameters, or (None, None).
+    """
+    for name, pattern in ENDPOINTS.items():
+        match = pattern.match(path)
+        if match:
+            return name, match.groupdict()
+    return None, None
+
+
+def seeded_random(path, seed):
+    """
+    Returns a random generator seeded by the request path so generated responses are stable across requests.
+    """
+    digest = hashlib.md5(f'{seed}:{path.lower()}'.encode('utf-8')).hexdigest()
+    return random.Random(int(digest, 16))
+
+
+def make_username(rng):
+    return 'player' + ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(8))
+
+
+def make_game(rng, username, year, month, index):
+    """
+    This function generates a finished game in the chess.com format. Games start from a common opening line and continue with random
+    legal moves, so positions repeat between games like they would for a real player.
+    """
+    eco, line = rng.choice(OPENING_LINES)
+    opponent = make_username(rng)
+    is_white = rng.random() < 0.5
+    white, black = (username, opponent) if is_white else (opponent, username)
+    time_class = rng.choice(list(TIME_CLASSES))
+
+    board = chess.Board()
+    for san in line.split():
+        board.push_san(san)
+    for _ in range(rng.randint(10, 80)):
+        if board.is_game_over():
+            break
+        board.push(rng.choice(list(board.legal_moves)))
+
+    # decide result from the board if the game finished, otherwise pick one
+    if board.is_checkmate():
+        loser = 'white' if board.turn == chess.WHITE else 'black'
+        results = {loser: 'checkmated', ('black' if loser == 'white' else 'white'): 'win'}
+        termination = f'{black if loser == "white" else white} won by checkmate'
+    elif board.is_game_over():
+        results = {'white': 'stalemate', 'black': 'stalemate'}
+        termination = 'Game drawn by stalemate'
+    else:
+        outcome = rng.random()
+        if outcome < 0.1:
+            draw = rng.choice(DRAWS)
+            results = {'white': draw, 'black': draw}
+            termination = f'Game drawn by {draw}'
+        else:
+            winner = 'white' if outcome < 0.55 else 'black'
+            loss = rng.choice(LOSSES[1:])
+            results = {winner: 'win', ('black' if winner == 'white' else 'white'): loss}
+            termination = f'{white if winner == "white" else black} won by {loss}'
+
+    game = chess.pgn.Game.from_board(board)
+    game.headers['Event'] = 'Live Chess'
+    game.headers['Site'] = 'Chess.com'
+    game.headers['Date'] = f'{year}.{month}.{rng.randint(1, 28):02d}'
+    game.headers['White'] = white
+    game.headers['Black'] = black
+    game.headers['ECO'] = eco
+    game.headers['Termination'] = termination
+    game_id = str(rng.randint(10**9, 10**10))
+
+    return {'url': f'https://www.chess.com/game/live/{game_id}', 'pgn': str(game), 'time_control': TIME_CLASSES[time_class],
+            'end_time': int(time.mktime((int(year), int(month), 1, 0, 0, 0, 0, 0, -1))) + index, 'rated': True,
+            'fen': board.fen(), 'time_class': time_class, 'rules': 'chess',
+            'white': {'rating': rng.randint(400, 2000), 'result': results['white'], 'username': white},
+            'black': {'rating': rng.randint(400, 2000), 'result': results['black'], 'username': black}}
+
+
+def generate_response(name, params, rng, args):
+    """
+    This function returns a synthetic response body for the given endpoint.
+    """
+    if name == 'country_players':
+        return {'players': sorted(make_username(rng) for _ in range(args.players))}
+
+    if name == 'country_clubs':
+        return {'clubs': [f'https://api.chess.com/pub/club/{params["iso"].lower()}-club-{i}' for i in range(args.clubs)]}
+
+    if name == 'club_members':
+        members = {'weekly': [], 'monthly': [], 'all_time': []}
+        for _ in range(args.players):
+            members[rng.choice(list(members))].append({'username': make_username(rng), 'joined': rng.randint(10**9, 2 * 10**9)})
+        return members
+
+    if name == 'player_profile':
+        return {'@id': f'https://api.chess.com/pub/player/{params["username"]}', 'url': f'https://www.chess.com/member/{params["username"]}',
+                'username': params['username'], 'player_id': rng.randint(10**6, 10**8), 'followers': rng.randint(0, 500),
+                'country': 'https://api.chess.com/pub/country/US', 'last_online': int(time.time()), 'joined': rng.randint(10**9, 2 * 10**9),
+                'status': 'basic', 'is_streamer': False, 'verified': False, 'league': rng.choice(['Wood', 'Stone', 'Bronze', 'Silver'])}
+
+    if name == 'player_stats':
+        stats = {}
+        for time_class in TIME_CLASSES:
+            rating = rng.randint(400, 2000)
+            stats[f'chess_{time_class}'] = {'last': {'rating': rating, 'date': int(time.time()), 'rd': rng.randint(30, 150)},
+                                            'best': {'rating': rating + rng.randint(0, 200), 'date': int(time.time()),
+                                                     'game': f'https://www.chess.com/game/live/{rng.randint(10**9, 10**10)}'},
+                                            'record': {'win': rng.randint(0, 500), 'loss': rng.randint(0, 500), 'draw': rng.randint(0, 50)}}
+        return stats
+
+    if name == 'player_games':
+        return {'games': [make_game(rng, params['username'], params['year'], params['month'], i) for i in range(rng.randint(0, 2 * args.games))]}
+
+
+def recording_path(recordings, path):
+    return os.path.join(recordings, path.strip('/').lower() + '.json')
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Handles GET requests for the supported chess.com endpoints.
+    """
+    server_version = 'DataKnightStandin/1.0'
+
+    def do_GET(self):
+        args = self.server.args
+        path = self.path.split('?')[0].rstrip('/')
+        name, params = match_endpoint(path)
+
+        # simulate network latency
+        delay = max(0.0, args.latency + random.uniform(-args.jitter, args.jitter))
+        if delay:
+            time.sleep(delay)
+
+        if name is None:
+            return self.send_json(404, {'code': 0, 'message': 'Data provider not found for key'}, name)
+
+        # inject failures before serving anything
+        roll = random.random()
+        if roll < args.rate_limit:
+            return self.send_json(429, {'code': 0, 'message': 'Too many requests'}, name, headers={'Retry-After': '1'})
+        if roll < args.rate_limit + args.error_rate:
+            return self.send_json(500, {'code': 0, 'message': 'Internal server error'}, name)
+
+        if args.mode == 'generate':
+            return self.send_json(200, generate_response(name, params, seeded_random(path, args.seed), args), name)
+
+        file_path = recording_path(args.recordings, path)
+        if args.mode == 'replay':
+            if not os.path.exists(file_path):
+                return self.send_json(404, {'code': 0, 'message': f'No recording for {path}'}, name)
+            with open(file_path, 'rb') as f:
+                return self.send_body(200, f.read(), name)
+
+        # record mode: proxy to chess.com and save successful responses
+        request = urllib.request.Request(API_HOST + path, headers={'User-Agent': args.user_agent})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                body = response.read()
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(body)
+            return self.send_body(200, body, name)
+        except urllib.error.HTTPError as err:
+            return self.send_body(err.code, err.read(), name)
+        except urllib.error.URLError as err:
+            return self.send_json(502, {'code': 0, 'message': f'Could not reach chess.com: {err.reason}'}, name)
+
+    def send_json(self, status, data, name, headers=None):
+        self.send_body(status, json.dumps(data).encode('utf-8'), name, headers)
+
+    def send_body(self, status, body, name, headers=None):
+        self.server.count(name, status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.args.verbose:
+            super().log_message(format, *args)
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server that keeps a count of responses served per endpoint and status code.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, args):
+        super().__init__(address, StandinHandler)
+        self.args = args
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def count(self, name, status):
+        with self.lock:
+            self.counts[(name or 'unknown', status)] += 1
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        total = sum(self.counts.values())
+        lines = [f'Served {total} responses in {elapsed:0.1f}s ({total / elapsed if elapsed else 0:0.1f} req/s)']
+        for (name, status), count in sorted(self.counts.items()):
+            lines.append(f'  {name:<16} {status}  {count}')
+        return '\n'.join(lines)
+
+
+def stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local stand-in server for the chess.com public API.')
+    parser.add_argument('--mode', choices=['record', 'replay', 'generate'], default='generate')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--recordings', default='./data/recordings', help='directory for recorded responses')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean delay added to every response (s)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform +/- variation around the latency (s)')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 500')
+    parser.add_argument('--players', type=int, default=100, help='generated players per country/club')
+    parser.add_argument('--clubs', type=int, default=5, help='generated clubs per country')
+    parser.add_argument('--games', type=int, default=30, help='average generated games per player per month')
+    parser.add_argument('--seed', type=int, default=0, help='seed for generated responses')
+    parser.add_argument('--user-agent', default='DataKnight stand-in recorder', help='User-Agent sent to chess.com when recording')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = StandinServer((args.host, args.port), args)
+    print(f'Serving chess.com stand-in ({args.mode}) on http://{args.host}:{args.port}')
+    print(f'Set CHESSDOTCOM_HOST=http://{args.host}:{args.port} to point the scraper or app at it')
+
+    # stop cleanly (and print the summary) when terminated by a load-test harness
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.summary())
+
+
+if __name__ == '__main__':
+    main()
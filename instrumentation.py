@@ -0,0 +1,341 @@
+# Pipeline Instrumentation (DataKnight)
+
+import os
+import re
+import copy
+import sys
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from chessdotcom.client import Client, RateLimitHandler, Resource
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+"""
+This is a lightweight instrumentation layer shared by chessdotcom-scraper.py, player-analysis.py and batch-analysis.py, which all set up the
+chess.com client with configure_client(). It times each stage of the pipeline
+(fetch, parse, replay, index, aggregate, render), keeps per-endpoint request latency histograms with error/retry counts, cache hit/miss
+counters and the memory high-water mark. Every finished span and request is emitted as a JSON log line on the "dataknight" logger
+(written to the file in DATAKNIGHT_LOG if set), and write_prometheus() dumps all metrics in the Prometheus text format (to the file in
+DATAKNIGHT_METRICS if set).
+"""
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# request paths are reduced to their endpoint so usernames/dates don't explode the label set
+ENDPOINT_PATTERNS = [
+    ('country_players', re.compile(r'/country/[^/]+/players$')),
+    ('country_clubs', re.compile(r'/country/[^/]+/clubs$')),
+    ('club_members', re.compile(r'/club/[^/]+/members$')),
+    ('player_stats', re.compile(r'/player/[^/]+/stats$')),
+    ('player_games', re.compile(r'/player/[^/]+/games/\d{4}/\d{2}$')),
+    ('player_profile', re.compile(r'/player/[^/]+$')),
+]
+
+logger = logging.getLogger('dataknight')
+logger.setLevel(logging.INFO)
+if os.environ.get('DATAKNIGHT_LOG') and not logger.handlers:
+    logger.addHandler(logging.FileHandler(os.environ['DATAKNIGHT_LOG']))
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket bounds (Prometheus style).
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    """
+    Process-wide metrics store. Spans are also kept per thread so the Streamlit app can show the breakdown of the current rerun only.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.histograms = {}
+        self.max_rss = 0
+        self.local = threading.local()
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def observe(self, name, value, buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def update_memory(self):
+        """
+        Records the memory high-water mark of the process in bytes (ru_maxrss is in KB on Linux and bytes on macOS).
+        """
+        if resource is None:
+            return None
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss = rss if sys.platform == 'darwin' else rss * 1024
+        self.max_rss = max(self.max_rss, rss)
+        return rss
+
+    @property
+    def spans(self):
+        if not hasattr(self.local, 'spans'):
+            self.local.spans = []
+        return self.local.spans
+
+    def start_run(self):
+        """
+        Clears the spans recorded by the current thread (called at the start of each app rerun).
+        """
+        self.local.spans = []
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.max_rss = 0
+        self.start_run()
+
+    def snapshot(self):
+        """
+        Returns a picklable copy of the counters, histograms and memory high-water mark (e.g. to send back from a worker process).
+        """
+        with self.lock:
+            return {'counters': dict(self.counters), 'histograms': copy.deepcopy(self.histograms), 'max_rss': self.max_rss}
+
+    def merge(self, snapshot):
+        """
+        Adds a snapshot taken in another process to these metrics. The memory high-water mark becomes the highest of any process.
+        """
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] += value
+            for key, other in snapshot['histograms'].items():
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(other.buckets)
+                histogram = self.histograms[key]
+                histogram.counts = [a + b for a, b in zip(histogram.counts, other.counts)]
+                histogram.count += other.count
+                histogram.sum += other.sum
+            self.max_rss = max(self.max_rss, snapshot['max_rss'])
+
+
+metrics = Metrics()
+
+
+def log_event(event, **fields):
+    logger.info(json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, default=str))
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Times the enclosed block as a pipeline stage, e.g. `with span('parse', games=len(games)): ...`
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as err:
+        error = type(err).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        rss = metrics.update_memory()
+        metrics.observe('dataknight_stage_seconds', duration, STAGE_BUCKETS, stage=stage)
+        if error:
+            metrics.inc('dataknight_stage_errors_total', stage=stage, error=error)
+        metrics.spans.append({'stage': stage, 'seconds': duration, 'max_rss_mb': rss / 2**20 if rss else None, **fields})
+        log_event('span', stage=stage, seconds=round(duration, 4), max_rss=rss, error=error, **fields)
+
+
+def count_cache(cache, hit):
+    """
+    Counts a cache lookup (hit or miss) for the given cache name.
+    """
+    metrics.inc('dataknight_cache_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def count_retry(url, status):
+    """
+    Counts a retried request (e.g. after a 429 response) for the endpoint of the given url.
+    """
+    metrics.inc('dataknight_request_retries_total', endpoint=endpoint_label(url), status=status)
+
+
+def endpoint_label(url):
+    for name, pattern in ENDPOINT_PATTERNS:
+        if pattern.search(url):
+            return name
+    return 'other'
+
+
+def record_request(resource_, start, error):
+    duration = time.perf_counter() - start
+    endpoint = endpoint_label(resource_.url)
+    status = getattr(error, 'status_code', None) or (type(error).__name__ if error else 200)
+    metrics.observe('dataknight_request_seconds', duration, LATENCY_BUCKETS, endpoint=endpoint)
+    metrics.inc('dataknight_requests_total', endpoint=endpoint, status=status)
+    log_event('request', endpoint=endpoint, url=resource_.url, status=status, seconds=round(duration, 4),
+              attempts=resource_.times_requested)
+
+
+def instrument_client():
+    """
+    Wraps the chessdotcom client so every API call (sync or async) records its latency, final status and rate-limit retries.
+    Safe to call more than once.
+    """
+    if getattr(Client, '_instrumented', False):
+        return
+
+    do_get_request = Client.do_get_request
+    should_try_again = RateLimitHandler.should_try_again
+
+    @wraps(do_get_request)
+    def timed_get_request(self, resource_):
+        start = time.perf_counter()
+        if self.aio:
+            async def timed():
+                try:
+                    response = await do_get_request(self, resource_)
+                except Exception as err:
+                    record_request(resource_, start, err)
+                    raise
+                record_request(resource_, start, None)
+                return response
+            return timed()
+
+        try:
+            response = do_get_request(self, resource_)
+        except Exception as err:
+            record_request(resource_, start, err)
+            raise
+        record_request(resource_, start, None)
+        return response
+
+    @wraps(should_try_again)
+    def counted_try_again(self, status_code, resource_):
+        retry = should_try_again(self, status_code, resource_)
+        if retry:
+            count_retry(resource_.url, status_code)
+        return retry
+
+    Client.do_get_request = timed_get_request
+    RateLimitHandler.should_try_again = counted_try_again
+    Client._instrumented = True
+
+
+def configure_client():
+    """
+    Sets up the chessdotcom client for the scripts: points it at a local stand-in server (see chessdotcom-standin.py) instead of
+    chess.com if CHESSDOTCOM_HOST is set, e.g. for load testing, and records request latencies, errors and retries.
+    """
+    api_host = os.environ.get('CHESSDOTCOM_HOST')
+    if api_host:
+        Resource.HOST = api_host.rstrip('/') + '/pub'
+    instrument_client()
+
+
+def format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def prometheus_text():
+    """
+    This function returns all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    with metrics.lock:
+        for name in sorted({name for name, _ in metrics.counters}):
+            lines.append(f'# TYPE {name} counter')
+            for (metric, labels), value in sorted(metrics.counters.items(), key=str):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+
+        for name in sorted({name for name, _ in metrics.histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), histogram in sorted(metrics.histograms.items(), key=str):
+                if metric != name:
+                    continue
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{name}_bucket{format_labels(labels, le=f"{bound:g}")} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {histogram.count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum!r}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+
+        lines.append('# TYPE dataknight_max_rss_bytes gauge')
+        lines.append(f'dataknight_max_rss_bytes {metrics.max_rss}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path=None):
+    """
+    Writes the metrics file to the given path (or DATAKNIGHT_METRICS). Does nothing if neither is set.
+    """
+    path = path or os.environ.get('DATAKNIGHT_METRICS')
+    if not path:
+        return
+    # every writer gets its own temp file (app sessions run in separate threads) and the last replace wins
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp', delete=False) as f:
+        f.write(prometheus_text())
+    os.chmod(f.name, 0o644)  # temp files are private, the metrics file is read by the collector
+    os.replace(f.name, path)
+
+
+def span_summary():
+    """
+    This function returns the spans of the current run aggregated by stage, in order of first appearance.
+    """
+    summary = {}
+    for s in metrics.spans:
+        stage = summary.setdefault(s['stage'], {'Stage': s['stage'], 'Calls': 0, 'Seconds': 0.0})
+        stage['Calls'] += 1
+        stage['Seconds'] += s['seconds']
+    return list(summary.values())
+
+
+def request_summary():
+    """
+    This function returns per-endpoint request counts, errors, retries and mean latency since the process started.
+    """
+    rows = {}
+    with metrics.lock:
+        for (name, labels), histogram in metrics.histograms.items():
+            if name == 'dataknight_request_seconds':
+                endpoint = dict(labels)['endpoint']
+                rows[endpoint] = {'Endpoint': endpoint, 'Requests': histogram.count, 'Errors': 0, 'Retries': 0,
+                                  'Mean (s)': histogram.sum / histogram.count}
+        for (name, labels), value in metrics.counters.items():
+            labels = dict(labels)
+            if labels.get('endpoint') not in rows:
+                continue
+            if name == 'dataknight_requests_total' and labels['status'] != 200:
+                rows[labels['endpoint']]['Errors'] += int(value)
+            elif name == 'dataknight_request_retries_total':
+                rows[labels['endpoint']]['Retries'] += int(value)
+    return sorted(rows.values(), key=lambda row: row['Endpoint'])
@@ -12,72 +12,20 @@ import chess.pgn
 import base64
 from stqdm import stqdm
 from collections import Counter
-from chessdotcom.aio import get_player_profile, get_player_stats, get_player_games_by_month
+from chessdotcom import ChessDotComError
+from chessdotcom.aio import get_player_profile, get_player_stats
+from analysis_engine import month_range, fetch_games, new_report, update_report, missing_months, saved_partitions, position_results
+from instrumentation import metrics, configure_client, span, count_cache, write_prometheus, span_summary, request_summary
 
 
 # This script generates a Streamlit web app that allows Chess.com players to analyze their positions.
 # Link to deployed app: dataknight.streamlit.app
 
+configure_client()
 
-async def get_games(player, start_month,start_year,end_month,end_year):
-    """
-    This function returns a list of all games that the player has completed in the given timeframe.
-    """
-    games = []
+# time each stage of the current rerun (see instrumentation.py)
+metrics.start_run()
 
-    # extract games for player
-    month_list = pd.period_range(start=str(start_month)+"-"+str(start_year), end=str(end_month)+"-"+str(end_year), freq='M')
-    for month in stqdm(month_list, ":runner: Getting games"):
-        data = await asyncio.gather(get_player_games_by_month(username=player, year=str(month)[:4], month=str(month)[-2:]))
-        games.extend(list(data[0].json.values())[0])
-    
-    return games
-
-
-def parse_games(games):
-    """
-    This functions converts a list of games into a pandas DataFrame.
-    """
-    games_df = []
-
-    # extract attributes for each game
-    for game in stqdm(games, desc=':male-factory-worker: Parsing games'):
-      game_id = game['url'].split('/')[-1]
-      white_player = game['white']['username']
-      black_player = game['black']['username']
-      white_rating = game['white']['rating']
-      black_rating = game['black']['rating']
-      white_result = game['white']['result']
-      black_result = game['black']['result']
-      time_class = game['time_class']
-      time_control = game['time_control']
-      rated = game['rated']
-      rules = game['rules']
-
-      # include opening/pgn if a move has been played
-      try:
-        pgn = game['pgn']
-        eco = game['pgn'].split('ECO "')[1].split('"')[0]
-
-        #eco_path = r"C:\Users\witte\Downloads\eco_codes.csv"
-        eco_path = eco_path = "./data/eco_codes.csv"
-        openings = pd.read_csv(eco_path)
-
-        opening_pgn = openings[openings['eco']==eco]['pgn'].values[0]
-        opening = openings[openings['eco']==eco]['name'].values[0]
-
-      except (KeyError, IndexError):
-        eco = None
-        pgn = None
-        opening = None
-        opening_pgn = None
-
-      # create row in df
-      games_df.append({'game_id':game_id, 'eco':eco, 'opening':opening, 'white_player':white_player, 'black_player':black_player,
-                       'white_rating':white_rating, 'black_rating':black_rating, 'white_result':white_result, 'black_result':black_result, 
-                       'time_class':time_class, 'time_control':time_control, 'rated':rated, 'rules':rules, 'opening_pgn':opening_pgn,'pgn':pgn})
-      
-    return pd.DataFrame.from_records(games_df)
 
 async def get_profile(player):
     """
@@ -129,46 +77,39 @@ async def show_stats(player, mode):
 
 def render_svg(svg):
     """Renders the given svg string."""
-    b64 = base64.b64encode(svg.encode('utf-8')).decode("utf-8")
-    html = r'<img src="data:image/svg+xml;base64,%s"/>' % b64
-    st.write(html, unsafe_allow_html=True)
-
-def get_fens(pgns):
-    all_fens = []
-    for i, pgn in enumerate(pgns):
-        fens = []
-        pgn_stringio = io.StringIO(pgn)
-        
-        if pgn is None:
-            st.write(f'{pgns.count(None)} Nones in pgn list')
-            st.write(f'{i} is None')
-        
-        game = chess.pgn.read_game(pgn_stringio)
-        board = game.board()
-        fens.append(game.board().fen().split(" ")[0])
+    with span('render'):
+        b64 = base64.b64encode(svg.encode('utf-8')).decode("utf-8")
+        html = r'<img src="data:image/svg+xml;base64,%s"/>' % b64
+        st.write(html, unsafe_allow_html=True)
 
-        for move in game.mainline_moves():
-            board.push(move)
-            fens.append(board.fen().split(" ")[0])
-        
-        all_fens.append(fens)
-        
-    return all_fens
-
-def check_fens(df, current_fen, is_white):
-    results = []
-    for i, fens in enumerate(df['fens']):
-        if current_fen in fens:
-            if is_white:
-                results.append(df['white_result'][i])
-            else:
-                results.append(df['black_result'][i])
+def load_games(username, date_range):
+    """
+    Brings the session's games up to date with the given months. Months that fell out of the range are dropped, months that aren't
+    loaded yet (or were still in progress when fetched) are taken from precomputed reports (see batch-analysis.py) when possible,
+    and only the rest are fetched and analyzed. Returns False (and shows an error) if the games couldn't be fetched.
+    """
+    if 'report' not in st.session_state or st.session_state.report['username'] != username:
+        st.session_state.report = new_report(username)
+    report = st.session_state.report
 
-    return results
+    missing = missing_months(report, date_range)
+    for month in date_range:
+        count_cache('month', month not in missing)
 
-def delete_games():
-    if 'games' in st.session_state:
-        del st.session_state['games']
+    saved = saved_partitions(username, missing) if missing else {}
+    for month in missing:
+        count_cache('report_file', month in saved)
+    missing = [month for month in missing if month not in saved]
+
+    # few requests at a time, backing off on 429s, to stay under chess.com's rate limit
+    fetched_at = time.time()
+    try:
+        games = asyncio.run(fetch_games(username, missing, progress=stqdm, concurrency=2, retries=3, retry_wait=1.0)) if missing else {}
+    except ChessDotComError:
+        st.error('Sorry, chess.com didn\'t return all of your games. Please try again in a moment.')
+        return False
+    update_report(report, date_range, games, progress=stqdm, fetched_at=fetched_at, partitions=saved)
+    return True
 
 # fix multi button presses
 # def disable():
@@ -229,8 +170,8 @@ with st.sidebar:
         end_month = st.selectbox(f'**End Month**', months, index=months.index(9))
 
     new_dates = st.button(f':runner: **Get Data**')
-    if new_dates:
-        delete_games()
+
+    show_debug = st.checkbox(f':stopwatch: Debug timings')
 
 
 header_cols = st.columns(3)    
@@ -247,7 +188,8 @@ with header_cols[1]:
     username = st.text_input(f'Enter your **Chess.com** username...', value="tensirr")
     username = username.lower()
     try:
-        profile = asyncio.run(get_profile(username))
+        with span('fetch', target='profile'):
+            profile = asyncio.run(get_profile(username))
         found = True
     except:
         st.error('That username doesn\'t seem to exist...')
@@ -294,7 +236,8 @@ if found:
             mode = st.radio(f':clock1: **Mode**', modes, index=modes.index('Rapid'))
             
         try: 
-            stats = asyncio.run(show_stats(username,mode_dict[mode]))
+            with span('fetch', target='stats'):
+                stats = asyncio.run(show_stats(username,mode_dict[mode]))
         except:
             stats= {}
             st.error('Sorry, there\'s no data available for the specified mode.')
@@ -316,53 +259,35 @@ if found:
 
 
 
-    if "games" not in st.session_state or username != st.session_state.user:
-        st.session_state.user = username
-        st.session_state.games = asyncio.run(get_games(username,start_month=start_month,start_year=start_year,end_month=end_month,end_year=end_year))
+    # analysis is kept for the session and only updated for a new player or when new dates are requested
+    report_cached = ("report" in st.session_state and username == st.session_state.get('user')
+                     and st.session_state.report['username'] == username and not new_dates)
+    count_cache('report', report_cached)
+    if not report_cached:
+        if load_games(username, month_range(start_month, start_year, end_month, end_year)):
+            st.session_state.user = username
+        else:
+            # not loaded: the next rerun tries again
+            st.session_state.pop('user', None)
+
+    report = st.session_state.report
+    games_df = report['games_df']
 
     # TOP OPENINGS SECTION
     with tabs[2]:
         
-        if st.session_state.games == []:
+        if games_df.empty:
             st.error('Sorry, there\'s no data available for the specified time frame. Check if dates are valid.')
         else:
-            games_df = parse_games(st.session_state.games)
-            games_df = games_df[(games_df['rules']=='chess')]
-            games_df = games_df.dropna(subset='pgn')
-            games_df.reset_index(inplace=True)
-            games_df['white_player'] = games_df['white_player'].str.lower()
-            games_df['black_player'] = games_df['black_player'].str.lower()
-            games_df['fens'] = get_fens(games_df['pgn'])
-            
             st.write("---")
 
             analysis_cols = st.columns(3)
             with analysis_cols[0]:
 
-                if chosen_color == ':white_circle: White':
-                    white = True
-                    analysis_df = games_df[games_df['white_player']==username]
-                else:
-                    white = False
-                    analysis_df = games_df[games_df['black_player']==username]
+                white = chosen_color == ':white_circle: White'
+                openings_stats = report['openings']['white' if white else 'black']
 
                 st.write(f'**Openings faced as {"White :white_circle:" if white else "Black :black_circle:"}**')
-                openings_stats = pd.DataFrame()
-
-                openings_stats['Opening'] = analysis_df['opening'].value_counts().index
-
-                games_played = analysis_df["opening"].value_counts().values
-                games_played_pct = 100.0*analysis_df["opening"].value_counts(normalize=True).values
-                openings_stats['Games Played'] = [f'{value} ({pct:0.1f}%)' for value, pct in zip(games_played,games_played_pct)]
-
-                totals = []
-                for opening in openings_stats['Opening']:
-                    
-       
-                    total = len(analysis_df[analysis_df["opening"]==opening])
-                    totals.append(total)
-
-                #openings_stats['totals'] = totals
 
                 st.write(openings_stats)
 
@@ -376,7 +301,7 @@ if found:
                 
             
     with tabs[3]:
-        if st.session_state.games == []: 
+        if games_df.empty: 
             st.error('Sorry, there\'s no data available for the specified time frame. Check if dates are valid.')
         else: 
             # account for variation overlap
@@ -493,12 +418,7 @@ if found:
                 if st.session_state.move_num != -1:
 
                     with outcome_display.container():
-                        if white:
-                            col = 'white_player'
-                        else:
-                            col = 'black_player'
-                            
-                        results = check_fens(games_df[(games_df[col]==username)&(games_df['game_id']!=chosen_game_id)].reset_index(), st.session_state.board.fen().split(" ")[0], white)
+                        results = position_results(report['positions'], st.session_state.board.fen().split(" ")[0], white, exclude_game_id=chosen_game_id)
 
 
                         if len(results) > 0 :
@@ -575,10 +495,7 @@ if found:
                         time.sleep(speed)
                         
                         
-                        if white:
-                            results = check_fens(games_df[games_df['white_player']==username].reset_index(), st.session_state.board.fen().split(" ")[0], white)
-                        else:
-                            results = check_fens(games_df[games_df['black_player']==username].reset_index(), st.session_state.board.fen().split(" ")[0], white)
+                        results = position_results(report['positions'], st.session_state.board.fen().split(" ")[0], white)
 
                         with output.container():
                             render_svg(svg)
@@ -587,6 +504,22 @@ if found:
                                 st.write(f'**{side} played {fullmove_number}. {move_san} ({termination})**')
                             else:
                                 st.write(f'**{side} played {fullmove_number}. {move_san}**')
+
+
+
+# DEBUG PANEL
+if show_debug:
+    with st.sidebar:
+        st.write("---")
+        st.subheader(f':stopwatch: Debug')
+        st.write(f'**Stages (this rerun)**')
+        st.dataframe(pd.DataFrame(span_summary()), hide_index=True)
+        st.write(f'**Requests (since start)**')
+        st.dataframe(pd.DataFrame(request_summary()), hide_index=True)
+        st.write(f'**Memory high-water**: {metrics.max_rss / 2**20:0.0f} MB')
+
+write_prometheus()
+
                     
 
 